@@ -3,7 +3,6 @@ import copy
 import json
 import logging
 import os
-import pkg_resources as pkgr
 from os.path import expanduser
 from pathlib import Path
 import jsonschema
@@ -39,15 +38,16 @@ class Config:
     schema_file_name = "qcodesrc_schema.json"
     """Name of schema file"""
     # get abs path of packge config file
-    default_file_name = pkgr.resource_filename(__name__, config_file_name)
+    default_file_name = os.path.join(os.path.dirname(__file__),
+                                     config_file_name)
     """Filename of default config"""
     current_config_path = default_file_name
     """Path of the last loaded config file"""
     _loaded_config_files = [default_file_name]
 
     # get abs path of schema  file
-    schema_default_file_name = pkgr.resource_filename(__name__,
-                                                      schema_file_name)
+    schema_default_file_name = os.path.join(os.path.dirname(__file__),
+                                            schema_file_name)
     """Filename of default schema"""
 
     # home dir, os independent
@@ -1,7 +1,10 @@
-import re
 import textwrap
-from typing import Optional, Union, Dict, List, Tuple
+from typing import Iterator, Optional, Type, Union, Dict, List, Tuple
 from collections import defaultdict
+from contextlib import contextmanager
+from functools import lru_cache
+
+import numpy as np
 
 from qcodes import VisaInstrument, MultiParameter
 from qcodes.instrument_drivers.Keysight.keysightb1500.KeysightB1500_module \
@@ -16,6 +19,64 @@ from .KeysightB1500_module import B1500Module, parse_module_query_response, \
 from . import constants
 from .message_builder import MessageBuilder
 
+# Mapping from module model names to driver classes, used by
+# :meth:`KeysightB1500.from_model_name`. Drivers for new modules can
+# register themselves here.
+_MODULE_CLASSES: Dict[str, Type[B1500Module]] = {
+    "B1517A": B1517A,
+    "B1520A": B1520A,
+    "B1530A": B1530A,
+}
+
+# Parameter docstrings, dedented once at import instead of on every
+# instantiation of the instrument
+_AUTOZERO_DOC = textwrap.dedent("""
+            Enable or disable cancelling of the offset of the
+            high-resolution A/D converter (ADC).
+
+            Set the function to OFF in cases that the measurement speed is
+            more important than the measurement accuracy. This roughly halves
+            the integration time.""")
+
+_SWEEP_DOC = textwrap.dedent("""
+               This is MultiParameter. Running the sweep runs the measurement
+               on the list of source values defined using
+               `setup_staircase_sweep` method. The output is a
+               primary parameter (e.g. Gate current)  and a secondary
+               parameter (e.g. Source/Drain current) both of which use the same
+               setpoints. Note you must `set_measurement_mode` and specify
+               2 channels as the argument before running the sweep. First
+               channel (SMU) must be the channel on which you set the sweep (
+               WV) and second channel(SMU) must be the one which remains at
+               constants voltage.
+                              """)
+
+
+@lru_cache(maxsize=16)
+def _fmt_message(fmt_format: Union[constants.FMT.Format, int],
+                 fmt_mode: Union[constants.FMT.Mode, int]) -> str:
+    """Return the (memoized) ``FMT`` command string for the given format
+    and mode."""
+    return MessageBuilder().fmt(fmt_format, fmt_mode).message
+
+
+def _parse_lrn_response_segment(response: str, key: str) -> List[str]:
+    """
+    Extract the comma-separated values that follow the given setting
+    ``key`` (e.g. ``'MM'``) in a ``LRN?`` response of semicolon-separated
+    settings, for example ``'TM1;MM16,1,2;FMT1,1'``.
+    """
+    index = response.find(key)
+    if index < 0:
+        raise ValueError(f'Measurement Mode ({key}) not found.')
+    rest = response[index + len(key):]
+    end = rest.find(';')
+    segment = rest if end < 0 else rest[:end]
+    parts = segment.split(',')
+    if len(parts) < 2:
+        raise ValueError(f'Measurement Mode ({key}) not found.')
+    return parts
+
 
 class KeysightB1500(VisaInstrument):
     """Driver for Keysight B1500 Semiconductor Parameter Analyzer.
@@ -23,11 +84,36 @@ class KeysightB1500(VisaInstrument):
     For the list of supported modules, refer to :meth:`from_model_name`.
     """
     calibration_time_out = 60  # 30 seconds suggested by manual
+
+    # Precomputed messages for parameter-less commands, so that no
+    # MessageBuilder has to be instantiated for them on every call
+    _MSG_ERR_QUERY = MessageBuilder().err_query().message
+    _MSG_ERRX_QUERY_DEFAULT = MessageBuilder().errx_query().message
+    _MSG_LRN_SETTINGS = MessageBuilder().lrn_query(
+        type_id=constants.LRN.Type.TM_AV_CM_FMT_MM_SETTINGS).message
+
     def __init__(self, name, address, **kwargs):
         super().__init__(name, address, terminator="\r\n", **kwargs)
         self.by_slot = {}
         self.by_channel = {}
         self.by_kind = defaultdict(list)
+        self._error_check_deferred: bool = False
+
+        # Snapshot of the spot-measurement parameters of the installed
+        # SMUs, populated in :meth:`add_module`, so that resetting their
+        # measurement statuses does not have to walk the parameter
+        # dictionary of every SMU on each call
+        self._smu_spot_measurement_parameters: Dict[str, List] = {
+            'voltage': [],
+            'current': [],
+        }
+
+        # Cached results of the ``LRN?`` settings queries, invalidated
+        # whenever a command is written that may change those settings
+        self._mm_cache: Optional[Dict[str, Union[constants.MM.Mode,
+                                                 List]]] = None
+        self._fmt_cache: Optional[Dict[str, Union[constants.FMT.Format,
+                                                  constants.FMT.Mode]]] = None
 
         self._find_modules()
 
@@ -39,42 +125,56 @@ class KeysightB1500(VisaInstrument):
                            val_mapping=create_on_off_val_mapping(
                                on_val=True, off_val=False),
                            initial_cache_value=False,
-                           docstring=textwrap.dedent("""
-            Enable or disable cancelling of the offset of the 
-            high-resolution A/D converter (ADC).
-    
-            Set the function to OFF in cases that the measurement speed is 
-            more important than the measurement accuracy. This roughly halves
-            the integration time."""))
+                           docstring=_AUTOZERO_DOC)
 
         self.add_parameter(name='run_iv_staircase_sweep',
                            parameter_class=IVSweepMeasurement,
-                           docstring=textwrap.dedent("""
-               This is MultiParameter. Running the sweep runs the measurement 
-               on the list of source values defined using 
-               `setup_staircase_sweep` method. The output is a 
-               primary parameter (e.g. Gate current)  and a secondary  
-               parameter (e.g. Source/Drain current) both of which use the same 
-               setpoints. Note you must `set_measurement_mode` and specify 
-               2 channels as the argument before running the sweep. First 
-               channel (SMU) must be the channel on which you set the sweep (
-               WV) and second channel(SMU) must be the one which remains at 
-               constants voltage. 
-                              """))
+                           docstring=_SWEEP_DOC)
 
         self.connect_message()
 
     def write(self, cmd):
         """
         Extend write method from the super to ask for error message each
-        time a write command is called.
+        time a write command is called. The error check is skipped inside
+        a :meth:`deferred_error_check` context, which checks once on exit
+        instead.
         """
         super().write(cmd)
+        # 'MM' also matches e.g. 'CMM' commands, which costs no more than
+        # a spurious requery on the next settings lookup
+        if 'MM' in cmd or 'FMT' in cmd:
+            self._invalidate_settings_caches()
+        if not self._error_check_deferred:
+            self._check_for_error()
+
+    def _invalidate_settings_caches(self) -> None:
+        self._mm_cache = None
+        self._fmt_cache = None
+
+    def _check_for_error(self) -> None:
         error_message = self.error_message()
-        if error_message != '+0,"No Error."':
+        # a '+0,' prefix means 'No Error.'; checking only the prefix keeps
+        # the comparison on this hot path as short as possible
+        if not error_message.startswith('+0,'):
             raise RuntimeError(f"While setting this parameter received "
                                f"error: {error_message}")
 
+    @contextmanager
+    def deferred_error_check(self) -> Iterator[None]:
+        """
+        Context manager that defers the per-write error check to a single
+        check when the context is left. Use this around blocks that issue
+        many write commands to halve the number of VISA round-trips, at the
+        cost of only learning about an error at the end of the block.
+        """
+        self._error_check_deferred = True
+        try:
+            yield
+        finally:
+            self._error_check_deferred = False
+            self._check_for_error()
+
     def add_module(self, name: str, module: B1500Module) -> None:
         super().add_submodule(name, module)
 
@@ -83,11 +183,18 @@ class KeysightB1500(VisaInstrument):
         for ch in module.channels:
             self.by_channel[ch] = module
 
+        if module.MODULE_KIND == constants.ModuleKind.SMU:
+            for parameter_name, parameters in \
+                    self._smu_spot_measurement_parameters.items():
+                if parameter_name in module.parameters:
+                    parameters.append(module.parameters[parameter_name])
+
     def reset(self) -> None:
         """Performs an instrument reset.
 
         This does not reset error queue!
         """
+        self._invalidate_settings_caches()
         self.write("*RST")
 
     def get_status(self) -> int:
@@ -129,14 +236,10 @@ class KeysightB1500(VisaInstrument):
         Returns:
             A specific instance of :class:`.B1500Module`
         """
-        if model == "B1517A":
-            return B1517A(slot_nr=slot_nr, parent=parent, name=name)
-        elif model == "B1520A":
-            return B1520A(slot_nr=slot_nr, parent=parent, name=name)
-        elif model == "B1530A":
-            return B1530A(slot_nr=slot_nr, parent=parent, name=name)
-        else:
+        module_class = _MODULE_CLASSES.get(model)
+        if module_class is None:
             raise NotImplementedError("Module type not yet supported.")
+        return module_class(slot_nr=slot_nr, parent=parent, name=name)
 
     def enable_channels(self, channels: Optional[constants.ChannelList] = None
                         ) -> None:
@@ -182,8 +285,8 @@ class KeysightB1500(VisaInstrument):
         if parameter_name not in ('voltage', 'current'):
             raise ValueError(f'Parameter name should be one of [voltage,current], '
                              f'got {parameter_name}.')
-        for smu in self.by_kind[constants.ModuleKind.SMU]:
-            smu.parameters[parameter_name]._measurement_status = None
+        for parameter in self._smu_spot_measurement_parameters[parameter_name]:
+            parameter._measurement_status = None
 
     def use_nplc_for_high_speed_adc(
             self, n: Optional[int] = None) -> None:
@@ -307,8 +410,11 @@ class KeysightB1500(VisaInstrument):
             SLOT1" If no error occurred, this command returns 0,"No Error."
         """
 
-        msg = MessageBuilder().errx_query(mode=mode)
-        response = self.ask(msg.message)
+        if mode is None:
+            msg = self._MSG_ERRX_QUERY_DEFAULT
+        else:
+            msg = MessageBuilder().errx_query(mode=mode).message
+        response = self.ask(msg)
         return response
 
     def clear_buffer_of_error_message(self) -> None:
@@ -316,8 +422,7 @@ class KeysightB1500(VisaInstrument):
         This method clears the error message stored in buffer when the
         error_message command is executed.
         """
-        msg = MessageBuilder().err_query()
-        self.write(msg.message)
+        self.write(self._MSG_ERR_QUERY)
 
     def clear_timer_count(self, chnum: Optional[int] = None) -> None:
         """
@@ -368,41 +473,41 @@ class KeysightB1500(VisaInstrument):
         This method gets the measurement mode(MM) and the channels used
         for measurements. It outputs a dictionary with 'mode' and
         'channels' as keys.
+
+        The result is cached and reused until a command is written that
+        may change the measurement mode settings.
         """
-        msg = MessageBuilder().lrn_query(type_id=constants.LRN.
-                                         Type.TM_AV_CM_FMT_MM_SETTINGS)
-        response = self.ask(msg.message)
-        match = re.search('MM(?P<mode>.*?),(?P<channels>.*?)(;|$)', response)
+        if self._mm_cache is not None:
+            return self._mm_cache
 
-        if not match:
-            raise ValueError('Measurement Mode (MM) not found.')
+        response = self.ask(self._MSG_LRN_SETTINGS)
+        parts = _parse_lrn_response_segment(response, 'MM')
 
         out_dict: Dict[str, Union[constants.MM.Mode, List]] = {}
-        resp_dict = match.groupdict()
-        out_dict['mode'] = constants.MM.Mode(int(resp_dict['mode']))
-        out_dict['channels'] = list(map(int, resp_dict['channels'].split(',')))
+        out_dict['mode'] = constants.MM.Mode(int(parts[0]))
+        out_dict['channels'] = [int(channel) for channel in parts[1:]]
+        self._mm_cache = out_dict
         return out_dict
 
     def get_response_format_and_mode(self) -> \
             Dict[str, Union[constants.FMT.Format, constants.FMT.Mode]]:
         """
         This method queries the the data output format and mode.
+
+        The result is cached and reused until a command is written that
+        may change the data output format settings.
         """
-        msg = MessageBuilder().lrn_query(type_id=constants.LRN.
-                                         Type.TM_AV_CM_FMT_MM_SETTINGS)
-        response = self.ask(msg.message)
-        match = re.search('FMT(?P<format>.*?),(?P<mode>.*?)(;|$)',
-                          response)
+        if self._fmt_cache is not None:
+            return self._fmt_cache
 
-        if not match:
-            raise ValueError('Measurement Mode (FMT) not found.')
+        response = self.ask(self._MSG_LRN_SETTINGS)
+        parts = _parse_lrn_response_segment(response, 'FMT')
 
         out_dict: Dict[str, Union[constants.FMT.Format, constants.FMT.Mode]] \
             = {}
-        resp_dict = match.groupdict()
-        out_dict['format'] = constants.FMT.Format(int(resp_dict[
-                                                          'format']))
-        out_dict['mode'] = constants.FMT.Mode(int(resp_dict['mode']))
+        out_dict['format'] = constants.FMT.Format(int(parts[0]))
+        out_dict['mode'] = constants.FMT.Mode(int(parts[1]))
+        self._fmt_cache = out_dict
         return out_dict
 
     def enable_smu_filters(
@@ -437,6 +542,10 @@ class IVSweepMeasurement(MultiParameter, StatusMixin):
         instrument: Instrument to which this parameter communicates to.
     """
 
+    # Precomputed messages for the fixed commands sent on every sweep
+    _MSG_FMT_11 = MessageBuilder().fmt(1, 1).message
+    _MSG_XE = MessageBuilder().xe().message
+
     def __init__(self, name: str, instrument: B1517A, **kwargs):
         super().__init__(
             name,
@@ -460,49 +569,59 @@ class IVSweepMeasurement(MultiParameter, StatusMixin):
 
     def get_raw(self) -> Tuple[Tuple[float, ...], Tuple[float, ...]]:
         measurement_mode = self.instrument.get_measurement_mode()
-        if len(measurement_mode['channels']) != 2:
+        channels = measurement_mode['channels']
+        if len(channels) != 2:
             raise ValueError('Two measurement channels are needed, one for '
                              'gate current and other for source drain '
                              'current.')
 
-        smu = self.instrument.by_channel[measurement_mode['channels'][0]]
+        smu = self.instrument.by_channel[channels[0]]
 
         if not smu.setup_fnc_already_run:
             raise Exception(f'Sweep setup has not yet been run successfully '
                             f'on {smu.full_name}')
 
-        delay_time = smu.iv_sweep.step_delay()
-        if smu._average_coefficient < 0:
+        iv_sweep = smu.iv_sweep
+        delay_time = iv_sweep.step_delay()
+        num_steps = iv_sweep.sweep_steps()
+        average_coefficient = smu._average_coefficient
+        if average_coefficient < 0:
             # negative coefficient means nplc and positive means just
             # averaging
-            nplc = 128 * abs(smu._average_coefficient)
+            nplc = 128 * abs(average_coefficient)
             power_line_time_period = 1 / smu.power_line_frequency
             calculated_time = 2 * nplc * power_line_time_period
         else:
-            calculated_time = smu._average_coefficient * \
-                              delay_time
-        num_steps = smu.iv_sweep.sweep_steps()
+            calculated_time = average_coefficient * delay_time
         estimated_timeout = max(delay_time, calculated_time) * num_steps
         new_timeout = estimated_timeout * self._fudge
 
         format_and_mode = self.instrument.get_response_format_and_mode()
         fmt_format = format_and_mode['format']
         fmt_mode = format_and_mode['mode']
-        try:
-            self.root_instrument.write(MessageBuilder().fmt(1, 1).message)
-            with self.root_instrument.timeout.set_to(new_timeout):
-                raw_data = self.instrument.ask(MessageBuilder().xe().message)
-                parsed_data = fmt_response_base_parser(raw_data)
-        finally:
-            self.root_instrument.write(MessageBuilder().fmt(fmt_format,
-                                                            fmt_mode).message)
+        with self.root_instrument.deferred_error_check():
+            try:
+                self.root_instrument.write(self._MSG_FMT_11)
+                with self.root_instrument.timeout.set_to(new_timeout):
+                    raw_data = self.instrument.ask(self._MSG_XE)
+                    parsed_data = fmt_response_base_parser(raw_data)
+            finally:
+                self.root_instrument.write(_fmt_message(fmt_format, fmt_mode))
+
+        # De-interleave the three measured channels by reshaping each
+        # response field to (number of steps, 3); the columns are then
+        # views of the two measured parameters and the source voltage. The
+        # fields are converted one by one because they are of different
+        # types (float values, str statuses, etc.).
+        parsed_fields = tuple(
+            np.asarray(field).reshape(-1, 3) for field in parsed_data)
 
         self.param1 = _FMTResponse(
-            *[parsed_data[i][::3] for i in range(0, 4)])
+            *(field[:, 0] for field in parsed_fields))
         self.param2 = _FMTResponse(
-            *[parsed_data[i][1::3] for i in range(0, 4)])
+            *(field[:, 1] for field in parsed_fields))
         self.source_voltage = _FMTResponse(
-            *[parsed_data[i][2::3] for i in range(0, 4)])
+            *(field[:, 2] for field in parsed_fields))
 
         self.shapes = ((len(self.source_voltage.value),),) * 2
         self.setpoints = ((self.source_voltage.value,),) * 2
@@ -20,6 +20,15 @@ class MeasurementNotTaken(Exception):
     pass
 
 
+# Lookup table from channel letter codepoint (e.g. ``ord('A')``) to channel
+# name (e.g. 'CH1'), used by the vectorized path of
+# :func:`fmt_response_base_parser`.
+_CHANNEL_NAME_OF_LETTER = np.zeros(128, dtype='U5')
+for _channel_name in constants.ChannelName:
+    _CHANNEL_NAME_OF_LETTER[ord(_channel_name.name)] = _channel_name.value
+del _channel_name
+
+
 def fmt_response_base_parser(raw_data_val: str) -> _FMTResponse:
     """
     Parse the response from SPA for `FMT 1,0` format  into a named tuple
@@ -33,12 +42,33 @@ def fmt_response_base_parser(raw_data_val: str) -> _FMTResponse:
     """
 
     values_separator = ','
+    records = raw_data_val.split(values_separator)
+
+    # The FMT1,0/FMT1,1 records are fixed width (3 character header plus 12
+    # digit data), which allows parsing the response with a few vectorized
+    # NumPy operations instead of a Python-level loop over the records. The
+    # loop below is kept as a fallback for responses of non-uniform width.
+    str_array = np.asarray(records)
+    width = str_array.dtype.itemsize // np.dtype('U1').itemsize
+    if width > 3 and len(raw_data_val) == len(records) * (width + 1) - 1:
+        chars = str_array.view('U1').reshape(len(records), width)
+        codepoints = str_array.view(np.uint32).reshape(len(records), width)
+
+        data_val = np.ascontiguousarray(chars[:, 3:]).view(
+            f'U{width - 3}').ravel().astype(np.float64).tolist()
+        data_status = chars[:, 0].tolist()
+        data_channel = _CHANNEL_NAME_OF_LETTER[codepoints[:, 1]].tolist()
+        data_datatype = chars[:, 2].tolist()
+
+        return _FMTResponse(data_val, data_status, data_channel,
+                            data_datatype)
+
     data_val = []
     data_status = []
     data_channel = []
     data_datatype = []
 
-    for str_value in raw_data_val.split(values_separator):
+    for str_value in records:
         status = str_value[0]
         channel_id = constants.ChannelName[str_value[1]].value
 
@@ -247,6 +247,30 @@ def test_get_response_format_and_mode(b1500):
     assert measurement_mode['mode'] == constants.FMT.Mode(1)
 
 
+def test_get_measurement_mode_caches_response(b1500):
+    original_ask = b1500.ask
+    mock_ask = MagicMock()
+    b1500.ask = mock_ask
+
+    mock_ask.return_value = 'MM 1,1,2'
+    measurement_mode = b1500.get_measurement_mode()
+    assert b1500.get_measurement_mode() is measurement_mode
+    mock_ask.assert_called_once()
+
+    # writing a command that changes the measurement mode settings
+    # invalidates the cache
+    mock_ask.return_value = '+0,"No Error."'
+    b1500.set_measurement_mode(mode=constants.MM.Mode.SPOT, channels=[1, 2])
+
+    mock_ask.return_value = 'MM 1,1,2'
+    assert b1500.get_measurement_mode() is not measurement_mode
+
+    # pop the error that the simulated instrument queued for the unknown
+    # MM command, so that it does not leak into other tests
+    b1500.ask = original_ask
+    b1500.error_message()
+
+
 def test_enable_smu_filters(b1500):
     mock_write = MagicMock()
     b1500.write = mock_write